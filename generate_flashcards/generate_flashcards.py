@@ -1,10 +1,237 @@
-import json
+import asyncio
+import hashlib
+import itertools
 import logging
 import os
-import fire
+import re
+import sqlite3
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import cached_property, lru_cache
+from typing import List, Optional
+import aiofiles
+import orjson
 from dotenv import load_dotenv
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from tenacity import (
+    before_sleep_log,
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_random_exponential,
+)
 
-from openai import OpenAI
+# openai, tiktoken and fire are imported where they're used, since together they make up
+# most of the CLI's startup time and aren't needed for every command.
+
+_CARD_LIST_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "front": {"type": "string"},
+            "back": {"type": "string"},
+        },
+        "required": ["front", "back"],
+        "additionalProperties": False,
+    },
+}
+
+# Structured output schema for a single piece of content
+_CARDS_SCHEMA = {
+    "name": "cards",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {"cards": _CARD_LIST_SCHEMA},
+        "required": ["cards"],
+        "additionalProperties": False,
+    },
+}
+
+# Structured output schema for a pack of id-delimited content. Strict schemas can't have
+# arbitrary keys, so the results are a list of cards tagged with the id they belong to.
+_PACKED_CARDS_SCHEMA = {
+    "name": "packed_cards",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "results": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "string"},
+                        "cards": _CARD_LIST_SCHEMA,
+                    },
+                    "required": ["id", "cards"],
+                    "additionalProperties": False,
+                },
+            },
+        },
+        "required": ["results"],
+        "additionalProperties": False,
+    },
+}
+
+
+# The system messages and response formats are the same for every request, so they're
+# built once and shared rather than recreated for each one
+_SYSTEM_PROMPT = (
+    "Generate flashcards from the user's text. Output JSON matching the provided schema. "
+    "Produce one card per atomic fact."
+)
+
+_SYSTEM_MESSAGE = {"role": "system", "content": _SYSTEM_PROMPT}
+
+_PACKED_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": _SYSTEM_PROMPT
+    + ' The text contains sections delimited by "### id=<id>" and "### /id=<id>"; '
+    "return each section's cards separately under its id.",
+}
+
+_RESPONSE_FORMAT = {"type": "json_schema", "json_schema": _CARDS_SCHEMA}
+
+_PACKED_RESPONSE_FORMAT = {"type": "json_schema", "json_schema": _PACKED_CARDS_SCHEMA}
+
+
+class Card(BaseModel):
+    """
+    A single flashcard.
+    """
+
+    front: str
+    back: str
+
+
+# Built once since constructing the validator is much slower than running it
+_CARDS_ADAPTER = TypeAdapter(List[Card])
+
+
+def _is_transient_error(exception: BaseException) -> bool:
+    """
+    Whether the exception is a rate limit or transient server error worth retrying.
+    """
+    from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+    return isinstance(
+        exception, (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+    )
+
+
+@lru_cache(maxsize=None)
+def _token_counter(model: str):
+    """
+    Get a function which counts the tokens in a string for the model, using its tiktoken
+    tokeniser or the GPT-4o tokeniser for models tiktoken doesn't know about.
+
+    tiktoken downloads the tokeniser on first use. The counts are only estimates, so if
+    it can't be loaded, tokens are estimated as a quarter of the number of characters
+    rather than failing.
+    """
+    try:
+        import tiktoken
+
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logging.warning(f"Could not load the tokeniser for {model}, estimating tokens: {e}")
+        return lambda text: len(text) // 4
+
+    encode = encoding.encode
+
+    # Count special token text like "<|endoftext|>" in notes as normal text, rather
+    # than raising
+    return lambda text: len(encode(text, disallowed_special=()))
+
+
+class _TokenBucket:
+    """
+    A bucket of capacity which refills continuously at `limit` per minute.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.available = limit
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.limit, self.available + (now - self.updated) * self.limit / 60)
+        self.updated = now
+
+    async def acquire(self, amount: int):
+        """
+        Wait until `amount` is available and take it from the bucket. Requests larger than
+        the bucket only wait for it to be full, otherwise they would never be sent.
+        """
+        amount = min(amount, self.limit)
+
+        while True:
+            self._refill()
+
+            if self.available >= amount:
+                self.available -= amount
+                return
+
+            await asyncio.sleep((amount - self.available) * 60 / self.limit)
+
+    def update(self, limit: Optional[str], remaining: Optional[str]):
+        """
+        Correct the bucket using the limit and remaining capacity reported by the API.
+        """
+        self._refill()
+
+        if limit:
+            self.limit = int(limit)
+        if remaining:
+            self.available = min(self.available, int(remaining))
+
+
+class RateLimiter:
+    """
+    Throttles requests to stay within the API's requests per minute and tokens per minute
+    limits. The limits start at the given values and are then kept in line with the
+    `x-ratelimit-*` headers returned with each response.
+    """
+
+    def __init__(self, requests_per_minute: int = 500, tokens_per_minute: int = 30000):
+        self.requests = _TokenBucket(requests_per_minute)
+        self.tokens = _TokenBucket(tokens_per_minute)
+
+    async def acquire(self, tokens: int):
+        """
+        Wait until there is capacity for one request using `tokens` tokens.
+
+        Parameters
+        ----------
+        tokens:
+            The estimated number of tokens the request will use.
+        """
+        await self.requests.acquire(1)
+        await self.tokens.acquire(tokens)
+
+    def update(self, headers):
+        """
+        Update the limits from the rate limit headers of a response.
+
+        Parameters
+        ----------
+        headers:
+            The headers of the response.
+        """
+        self.requests.update(
+            headers.get("x-ratelimit-limit-requests"), headers.get("x-ratelimit-remaining-requests")
+        )
+        self.tokens.update(
+            headers.get("x-ratelimit-limit-tokens"), headers.get("x-ratelimit-remaining-tokens")
+        )
 
 
 class FlashcardGenerator:
@@ -15,15 +242,34 @@ class FlashcardGenerator:
     def __init__(
         self,
         api_key: str = None,
-        model: str = "gpt-4-turbo",
+        model: str = "gpt-4o",
         input_dir: str = None,
         output_dir: str = None,
         verbose: bool = False,
+        max_concurrency: int = 16,
+        use_cache: bool = True,
+        max_chunk_tokens: int = 2000,
+        fast_model: str = "gpt-4o-mini",
+        fast_model_max_chars: int = 500,
     ):
         """
         Initialize the FlashcardGenerator class.
         """
-        self.client = OpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY"))
+        # The clients are only created once they're needed
+        self._api_key = api_key or os.getenv("OPENAI_API_KEY")
+
+        # Rate limits are applied per model, so each model gets its own limiter
+        self.rate_limiters = defaultdict(RateLimiter)
+
+        # Maximum number of requests sent to the API at the same time, however they're split
+        # between files and chunks
+        self.max_concurrency = max_concurrency
+
+        # Whether to reuse flashcards previously generated for identical content
+        self.use_cache = use_cache
+
+        # Files longer than this are split into several requests
+        self.max_chunk_tokens = max_chunk_tokens
 
         # Make sure model is a string
         if not isinstance(model, str):
@@ -31,6 +277,13 @@ class FlashcardGenerator:
 
         self.model = model
 
+        # Short content is simple enough to send to a smaller, cheaper model
+        if fast_model is not None and not isinstance(fast_model, str):
+            raise TypeError("fast_model must be a string.")
+
+        self.fast_model = fast_model
+        self.fast_model_max_chars = fast_model_max_chars
+
         if not input_dir:
             self.input_dir = os.getcwd()
         else:
@@ -41,6 +294,10 @@ class FlashcardGenerator:
         else:
             self.output_dir = os.path.join(output_dir, "flashcards")
 
+        # Used to recognise the output directory while walking input_dir. The trailing
+        # separator stops sibling directories such as "flashcards_old" from matching.
+        self._output_prefix = os.path.abspath(self.output_dir) + os.sep
+
         # Set up logging
         logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s')
         if verbose:
@@ -48,7 +305,56 @@ class FlashcardGenerator:
         else:
             logging.getLogger().setLevel(logging.INFO)
 
-    def create_flashcard(self, content: str) -> dict:
+    @cached_property
+    def client(self):
+        """
+        The OpenAI client, used for the Batch API.
+        """
+        from openai import OpenAI
+
+        return OpenAI(api_key=self._api_key)
+
+    @cached_property
+    def async_client(self):
+        """
+        The asynchronous OpenAI client, used for chat completions. Requests share a pool
+        of HTTP/2 connections, so concurrent requests are multiplexed over a few
+        connections instead of each opening its own.
+        """
+        import httpx
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+        # DefaultAsyncHttpxClient keeps the SDK's own defaults, such as following redirects
+        http_client = DefaultAsyncHttpxClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+            timeout=httpx.Timeout(60.0, connect=5.0),
+        )
+
+        # Retries are handled by _complete, so the client mustn't retry as well
+        return AsyncOpenAI(api_key=self._api_key, http_client=http_client, max_retries=0)
+
+    @cached_property
+    def _request_semaphore(self) -> asyncio.Semaphore:
+        """
+        Limits the requests in flight to `max_concurrency`. It's only created once a request
+        is made, so it belongs to the event loop that makes it.
+        """
+        return asyncio.Semaphore(self.max_concurrency)
+
+    async def _close_async_client(self):
+        """
+        Close the asynchronous client's connections, if it has been created. Connections
+        belong to the event loop they were opened in, so the client and the request semaphore
+        are rebuilt if needed again.
+        """
+        self.__dict__.pop("_request_semaphore", None)
+        async_client = self.__dict__.pop("async_client", None)
+
+        if async_client is not None:
+            await async_client.close()
+
+    async def create_flashcard(self, content: str) -> dict:
         """
         Create a flashcard from the content using GPT.
 
@@ -70,77 +376,461 @@ class FlashcardGenerator:
                 ]
             }
         """
+        flashcards = self._get_cached(content)
+        if flashcards is not None:
+            logging.info(f"Using {len(flashcards)} cached flashcards.")
+            return flashcards
 
-        system_message = """
-        You are a flashcard generation bot. Given a piece of text, you will generate a flashcard as a JSON
-        object with the following format:
-        {
-            "cards": [
-                {
-                    "front": "Front of the flashcard",
-                    "back": "Back of the flashcard"
-                }
-            ]
-        }
-        
-        For example, given the text:
-        The capital of France is Paris.
-        
-        You would generate the flashcard:
-        {
-            "cards": [
-                {
-                    "front": "What is the capital of France?",
-                    "back": "Paris"
-                }
-            ]
-        }
+        request = self._build_request(content)
+        message, total_tokens = await self._complete(request)
 
-        If multiple flashcards can be generated from the text, you should generate all of them.
-        For example, given the text:
-        The capital of France is Paris. The capital of Spain is Madrid.
-        
-        You would generate the flashcards:
-        {
-            "cards": [
-                {
-                    "front": "What is the capital of France?",
-                    "back": "Paris"
-                },
-                {
-                    "front": "What is the capital of Spain?",
-                    "back": "Madrid"
-                }
-            ]
-        }
-        
-        NB: Return a valid JSON object.
+        flashcards = None
+
+        # Give the main model one chance to do better if the fast model got it wrong
+        if request["model"] != self.model:
+            try:
+                flashcards = orjson.loads(message)["cards"]
+                self.validate_flashcards(flashcards)
+            except (ValueError, KeyError, TypeError) as e:
+                logging.warning(
+                    f"{request['model']} generated invalid flashcards, "
+                    f"retrying with {self.model}: {e}"
+                )
+
+                request = self._build_request(content, model=self.model)
+                message, total_tokens = await self._complete(request)
+                flashcards = None
+
+        if flashcards is None:
+            flashcards = orjson.loads(message)["cards"]
+
+        logging.debug(f"Generated flashcards: {flashcards}")
+        logging.info(f"Generated {len(flashcards)} flashcards. Used {total_tokens} tokens.")
+
+        self._set_cached(content, flashcards)
+
+        return flashcards
+
+    async def _create_flashcards_pack(self, pack: list) -> dict:
         """
+        Create flashcards for a pack of content using a single request.
 
-        user_message = f"""
-        Create a flashcard from the following content:
-        {content}
-        NB: Return a valid JSON object.
+        Parameters
+        ----------
+        pack:
+            A list of (id, content) tuples to create flashcards from, all routed to the same
+            model.
+
+        Returns
+        -------
+        dict:
+            A dict mapping each id to its list of flashcards.
         """
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_message},
-            ],
-            response_format={"type": "json_object"},
-        )
+        flashcards = {}
+        uncached = []
 
-        flashcards = json.loads(response.choices[0].message.content)["cards"]
+        for item_id, content in pack:
+            cached = self._get_cached(content)
+            if cached is not None:
+                logging.info(f"Using {len(cached)} cached flashcards for {item_id}.")
+                flashcards[item_id] = cached
+            else:
+                uncached.append((item_id, content))
 
-        logging.debug(f"Generated flashcards: {flashcards}")
+        if not uncached:
+            return flashcards
+
+        # There is nothing to amortise for a single item, so use the simpler prompt
+        if len(uncached) == 1:
+            item_id, content = uncached[0]
+            flashcards[item_id] = await self._create_flashcards_chunked(content)
+            return flashcards
+
+        # Items are packed per routed model, so route on an item rather than the packed length
+        model = self._route_model(uncached[0][1])
+        generated = await self._complete_pack(uncached, model, validate=model != self.model)
+
+        # Give the main model one chance to do better with any the fast model got wrong
+        retry = [(item_id, content) for item_id, content in uncached if item_id not in generated]
+        if retry and model != self.model:
+            logging.warning(
+                f"{model} generated invalid flashcards for {len(retry)} files, "
+                f"retrying with {self.model}."
+            )
+            generated.update(await self._complete_pack(retry, self.model))
+
+        contents = dict(uncached)
+        for item_id, cards in generated.items():
+            self._set_cached(contents[item_id], cards)
+
+        flashcards.update(generated)
+
+        return flashcards
+
+    async def _complete_pack(self, pack: list, model: str, validate: bool = False) -> dict:
+        """
+        Send a pack of content to the model in a single request.
+
+        Parameters
+        ----------
+        pack:
+            A list of (id, content) tuples to create flashcards from.
+        model:
+            The model to send the pack to.
+        validate:
+            Whether to leave out flashcards which fail validation, and return nothing if
+            the response can't be parsed, instead of raising.
+
+        Returns
+        -------
+        dict:
+            A dict mapping each id to its list of flashcards. Ids the model didn't return
+            flashcards for are missing.
+        """
+        request = self._build_request(self._pack_content(pack), packed=True, model=model)
+        message, total_tokens = await self._complete(request)
+
+        try:
+            results = orjson.loads(message)["results"]
+        except (ValueError, KeyError, TypeError) as e:
+            if not validate:
+                raise
+
+            logging.warning(f"{model} generated an invalid response: {e}")
+            return {}
+
+        contents = dict(pack)
+        generated = {}
+
+        for result in results:
+            if result["id"] not in contents:
+                continue
+
+            if validate:
+                try:
+                    self.validate_flashcards(result["cards"])
+                except ValueError as e:
+                    logging.warning(f"{model} generated invalid flashcards for {result['id']}: {e}")
+                    continue
+
+            generated[result["id"]] = result["cards"]
+
+        logging.debug(f"Generated flashcards: {generated}")
         logging.info(
-            f"Generated {len(flashcards)} flashcards. Used {response.usage.total_tokens} tokens."
+            f"Generated {sum(len(cards) for cards in generated.values())} flashcards for "
+            f"{len(pack)} files. Used {total_tokens} tokens."
         )
 
-        return flashcards
+        return generated
+
+    async def _create_flashcards_chunked(self, content: str) -> list:
+        """
+        Create flashcards from the content, splitting it into chunks of at most
+        `max_chunk_tokens` tokens which are sent concurrently.
+
+        Parameters
+        ----------
+        content:
+            The content to create flashcards from.
+
+        Returns
+        -------
+        list:
+            The flashcards from every chunk, in the order the chunks appear in the content.
+        """
+        chunks = self._chunk_markdown(content, self.max_chunk_tokens)
+
+        if len(chunks) > 1:
+            logging.debug(f"Split content into {len(chunks)} chunks.")
+
+        results = await asyncio.gather(*(self.create_flashcard(chunk) for chunk in chunks))
+
+        return list(itertools.chain.from_iterable(results))
+
+    def _chunk_markdown(self, text: str, max_tokens: int = 2000) -> list:
+        """
+        Split markdown into chunks of at most `max_tokens` tokens, breaking at headings where
+        possible and at paragraphs within sections which are too long on their own.
+
+        Parameters
+        ----------
+        text:
+            The markdown to split.
+        max_tokens:
+            The maximum number of tokens in a chunk. A single paragraph longer than this is
+            left as one chunk.
+
+        Returns
+        -------
+        list:
+            The chunks of markdown.
+        """
+        count_tokens = _token_counter(self.model)
+
+        # Most files fit in one chunk, so leave them untouched
+        if count_tokens(text) <= max_tokens:
+            return [text]
+
+        sections = []
+        for section in re.split(r"\n(?=#{1,6}\s)", text):
+            tokens = count_tokens(section)
+
+            if tokens > max_tokens:
+                sections.extend(
+                    (paragraph, count_tokens(paragraph)) for paragraph in section.split("\n\n")
+                )
+            else:
+                sections.append((section, tokens))
+
+        chunks = []
+        chunk = []
+        chunk_tokens = 0
+
+        for section, tokens in sections:
+            if chunk and chunk_tokens + tokens > max_tokens:
+                chunks.append("\n\n".join(chunk))
+                chunk = []
+                chunk_tokens = 0
+
+            chunk.append(section)
+            chunk_tokens += tokens
+
+        if chunk:
+            chunks.append("\n\n".join(chunk))
+
+        return chunks
+
+    @retry(
+        wait=wait_random_exponential(min=1, max=60),
+        stop=stop_after_attempt(8),
+        retry=retry_if_exception(_is_transient_error),
+        before_sleep=before_sleep_log(logging.getLogger(), logging.WARNING),
+        reraise=True,
+    )
+    async def _complete(self, request: dict) -> tuple:
+        """
+        Send a chat completion request once the rate limits allow it, retrying with
+        exponential backoff if it fails with a rate limit or transient server error.
+        The completion is streamed so the message is buffered as it arrives.
+
+        Parameters
+        ----------
+        request:
+            The keyword arguments for `chat.completions.create`.
+
+        Returns
+        -------
+        tuple:
+            The message content as UTF-8 bytes, and the total number of tokens used.
+        """
+        rate_limiter = self.rate_limiters[request["model"]]
+
+        # Every request, whichever file or chunk it's for, counts towards max_concurrency
+        async with self._request_semaphore:
+            await rate_limiter.acquire(self._count_tokens(request))
+
+            raw_response = await self.async_client.chat.completions.with_raw_response.create(
+                **request, stream=True, stream_options={"include_usage": True}
+            )
+            rate_limiter.update(raw_response.headers)
+
+            message = bytearray()
+            total_tokens = None
+
+            async for chunk in raw_response.parse():
+                if chunk.choices:
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        message.extend(delta.encode("utf-8"))
+
+                # Usage is only sent on the final chunk, which has no choices
+                if chunk.usage:
+                    total_tokens = chunk.usage.total_tokens
+
+        return bytes(message), total_tokens
+
+    @staticmethod
+    def _count_tokens(request: dict) -> int:
+        """
+        Estimate the number of prompt tokens in the request.
+        """
+        count_tokens = _token_counter(request["model"])
+
+        return sum(count_tokens(message["content"]) for message in request["messages"])
+
+    @cached_property
+    def _cache(self) -> sqlite3.Connection:
+        """
+        The cache of previously generated flashcards, stored in the output directory.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        connection = sqlite3.connect(os.path.join(self.output_dir, ".flashcard_cache.sqlite"))
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS cache (k TEXT PRIMARY KEY, v TEXT)")
+
+        return connection
+
+    def _cache_key(self, content: str) -> str:
+        """
+        Hash the request that would be made for the content, so that changing the model
+        or the prompt invalidates previously cached flashcards.
+        """
+        request = orjson.dumps(self._build_request(content), option=orjson.OPT_SORT_KEYS)
+
+        return hashlib.sha256(request).hexdigest()
+
+    def _get_cached(self, content: str) -> Optional[list]:
+        """
+        Get the flashcards previously generated for the content, if there are any.
+
+        Parameters
+        ----------
+        content:
+            The content the flashcards were created from.
+
+        Returns
+        -------
+        list:
+            The cached flashcards, or None if there are none or caching is disabled.
+        """
+        if not self.use_cache:
+            return None
+
+        row = self._cache.execute(
+            "SELECT v FROM cache WHERE k = ?", (self._cache_key(content),)
+        ).fetchone()
+
+        return orjson.loads(row[0]) if row else None
+
+    def _set_cached(self, content: str, flashcards: list):
+        """
+        Store the flashcards generated for the content.
+
+        Parameters
+        ----------
+        content:
+            The content the flashcards were created from.
+        flashcards:
+            The flashcards to store.
+        """
+        if not self.use_cache:
+            return
+
+        with self._cache:
+            self._cache.execute(
+                "INSERT OR REPLACE INTO cache (k, v) VALUES (?, ?)",
+                (self._cache_key(content), orjson.dumps(flashcards).decode("utf-8")),
+            )
+
+    @staticmethod
+    def _pack_items(items: list, max_chars: int) -> list:
+        """
+        Greedily group items into packs whose combined content is at most `max_chars` long.
+        Items which are longer than `max_chars` on their own are put in a pack by themselves.
+
+        Parameters
+        ----------
+        items:
+            A list of (id, content) tuples.
+        max_chars:
+            The maximum number of content characters in a pack.
+
+        Returns
+        -------
+        list:
+            A list of packs, each a list of (id, content) tuples.
+        """
+        packs = []
+        pack = []
+        pack_chars = 0
+
+        for item_id, content in items:
+            if pack and pack_chars + len(content) > max_chars:
+                packs.append(pack)
+                pack = []
+                pack_chars = 0
+
+            pack.append((item_id, content))
+            pack_chars += len(content)
+
+        if pack:
+            packs.append(pack)
+
+        return packs
+
+    @staticmethod
+    def _pack_content(pack: list) -> str:
+        """
+        Join a pack of content into a single string, delimiting each item by its id.
+
+        Parameters
+        ----------
+        pack:
+            A list of (id, content) tuples.
 
-    def process_file(
+        Returns
+        -------
+        str:
+            The delimited content.
+        """
+        return "\n".join(
+            f"### id={item_id}\n{content}\n### /id={item_id}" for item_id, content in pack
+        )
+
+    def _build_request(self, content: str, packed: bool = False, model: str = None) -> dict:
+        """
+        Build the chat completion request body used to create flashcards from the content.
+
+        Parameters
+        ----------
+        content:
+            The content to create a flashcard from.
+        packed:
+            Whether the content holds several id-delimited sections, as built by
+            `_pack_content`, which should each have their own flashcards.
+        model:
+            The model to use. Defaults to `fast_model` for content shorter than
+            `fast_model_max_chars`, and `model` otherwise.
+
+        Returns
+        -------
+        dict:
+            The keyword arguments for `chat.completions.create`.
+        """
+        if model is None:
+            model = self._route_model(content)
+
+        # The content is sent as is, since the system message already says what to do with it
+        return {
+            "model": model,
+            "messages": [
+                _PACKED_SYSTEM_MESSAGE if packed else _SYSTEM_MESSAGE,
+                {"role": "user", "content": content},
+            ],
+            "response_format": _PACKED_RESPONSE_FORMAT if packed else _RESPONSE_FORMAT,
+        }
+
+    def _route_model(self, content: str) -> str:
+        """
+        Choose which model to send the content to.
+
+        Parameters
+        ----------
+        content:
+            The content to create flashcards from.
+
+        Returns
+        -------
+        str:
+            `fast_model` if it is set and the content is short, otherwise `model`.
+        """
+        if self.fast_model and len(content) < self.fast_model_max_chars:
+            return self.fast_model
+
+        return self.model
+
+    async def process_file(
         self, input_file_path: str, output_file_path: str, print_output: bool = False
     ):
         """
@@ -155,55 +845,580 @@ class FlashcardGenerator:
         print_output:
             Whether to print the output to the console.
         """
-        # Read the content of the .md file
-        with open(input_file_path, "r", encoding="utf-8") as infile:
-            logging.debug(f"Reading content from {input_file_path}.")
-            content = infile.read()
+        # process_file can be run directly from the command line, in its own event loop, so
+        # it closes the client's connections before that loop does
+        try:
+            # Read the content of the .md file, noting its modification time first so a change
+            # made while it's being processed isn't missed on the next run
+            input_mtime_ns = os.stat(input_file_path).st_mtime_ns
+            async with aiofiles.open(input_file_path, "r", encoding="utf-8") as infile:
+                logging.debug(f"Reading content from {input_file_path}.")
+                content = await infile.read()
 
-        # Create a flashcard using GPT
-        flashcards = self.create_flashcard(content)
+            # Create flashcards using GPT, splitting long files into chunks
+            flashcards = await self._create_flashcards_chunked(content)
 
-        output_content = self.format_flashcards(flashcards)
+            if print_output:
+                print(self.format_flashcards(flashcards))
+            else:
+                # Write the flashcard to the output file
+                await self._write_flashcards_async(output_file_path, flashcards)
+                self._write_sidecar(output_file_path, content, input_mtime_ns)
+        finally:
+            await self._close_async_client()
 
-        if print_output:
-            print(output_content)
-        else:
-            # Write the flashcard to the output file
-            with open(output_file_path, "w", encoding="utf-8") as outfile:
-                logging.info(f"Writing flashcards to {output_file_path}.")
-                logging.debug(f"Writing {output_content} to {output_file_path}.")
+    def process_files(
+        self, overwrite_files: bool = False, batch: bool = False, max_chars: int = 8000
+    ):
+        """
+        Recursively process .md files in input_dir and create flashcards in output_dir,
+        maintaining the directory structure. Small files are packed together into a single
+        request, and requests are sent to the API concurrently, with at most
+        `max_concurrency` requests in flight at once.
+
+        Parameters
+        ----------
+        overwrite_files:
+            Whether to overwrite files in the output directory.
+        batch:
+            Whether to submit the files through the OpenAI Batch API instead. This is
+            cheaper, but results can take up to 24 hours to arrive.
+        max_chars:
+            The maximum number of content characters to pack into a single request.
+        """
+        if batch:
+            return self.process_files_batch(overwrite_files)
+
+        tasks = self._collect_files(overwrite_files)
+
+        async def run():
+            try:
+                await self._gather(tasks, max_chars)
+            finally:
+                await self._close_async_client()
 
-                outfile.write(output_content)
+        asyncio.run(run())
 
-    def process_files(self, overwrite_files: bool = False):
+    def process_files_batch(
+        self,
+        overwrite_files: bool = False,
+        poll_interval: float = 10,
+        max_poll_interval: float = 600,
+    ):
         """
-        Recursively process .md files in input_dir and create flashcards in output_dir,
-        maintaining the directory structure.
+        Recursively process .md files in input_dir using the OpenAI Batch API and create
+        flashcards in output_dir, maintaining the directory structure. A batch can only use
+        one model, so a separate batch is submitted for each model files are routed to.
+        Blocks until every batch has finished.
 
         Parameters
         ----------
         overwrite_files:
             Whether to overwrite files in the output directory.
+        poll_interval:
+            The initial number of seconds to wait between checks on the batch status.
+        max_poll_interval:
+            The maximum number of seconds to wait between checks on the batch status.
+
+        Raises
+        ------
+        RuntimeError:
+            If any batch does not complete successfully. The results of the other batches
+            are still written.
         """
-        for root, _, files in os.walk(self.input_dir):
-            if root.startswith(self.output_dir):
-                logging.debug(f"Skipping {root}. Output directory.")
+        tasks = self._collect_files(overwrite_files)
+
+        if not tasks:
+            logging.info("No files to process.")
+            return
+
+        # For each model, map each request's custom_id back to its content, the input's
+        # modification time and the file the flashcards should be written to, alongside
+        # the JSONL lines of the requests
+        pending = {}
+        batch_lines = {}
+
+        for input_file_path, relative_path, output_file_path in tasks:
+            # A file which can't be read is skipped rather than stopping the batch
+            try:
+                input_mtime_ns = os.stat(input_file_path).st_mtime_ns
+                with open(input_file_path, "r", encoding="utf-8") as infile:
+                    logging.debug(f"Reading content from {input_file_path}.")
+                    content = infile.read()
+            except (OSError, UnicodeDecodeError) as e:
+                logging.error(f"Failed to process {relative_path}: {e}")
+                continue
+
+            flashcards = self._get_cached(content)
+            if flashcards is not None:
+                logging.info(f"Using {len(flashcards)} cached flashcards.")
+                self._write_flashcards(output_file_path, flashcards)
+                self._write_sidecar(output_file_path, content, input_mtime_ns)
                 continue
 
-            for file in files:
-                if file.endswith(".md"):
-                    input_file_path = os.path.join(root, file)
-                    output_file_path = os.path.join(
-                        self.output_dir, os.path.relpath(input_file_path, self.input_dir)
+            body = self._build_request(content)
+            request = {
+                "custom_id": relative_path,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": body,
+            }
+
+            model = body["model"]
+            pending.setdefault(model, {})[relative_path] = (
+                content,
+                input_mtime_ns,
+                output_file_path,
+            )
+            batch_lines.setdefault(model, []).append(orjson.dumps(request) + b"\n")
+
+        if not pending:
+            logging.info("All files were cached. Nothing to submit.")
+            return
+
+        batches = []
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for model, lines in batch_lines.items():
+                batch_file_path = os.path.join(tmp_dir, f"batch-{len(batches)}.jsonl")
+
+                with open(batch_file_path, "wb") as batch_file:
+                    batch_file.writelines(lines)
+
+                with open(batch_file_path, "rb") as batch_file:
+                    batch_input_file = self.client.files.create(file=batch_file, purpose="batch")
+
+                batch = self.client.batches.create(
+                    input_file_id=batch_input_file.id,
+                    endpoint="/v1/chat/completions",
+                    completion_window="24h",
+                )
+                logging.info(f"Submitted batch {batch.id} with {len(lines)} files for {model}.")
+
+                batches.append((batch, pending[model]))
+
+        failed = []
+
+        for batch, batch_pending in batches:
+            batch = self._wait_for_batch(batch, poll_interval, max_poll_interval)
+
+            if batch.status != "completed":
+                logging.error(f"Batch {batch.id} finished with status {batch.status}.")
+                failed.append(batch)
+                continue
+
+            self._write_batch_results(batch, batch_pending)
+
+        if failed:
+            raise RuntimeError(
+                "Batches did not complete: "
+                + ", ".join(f"{batch.id} ({batch.status})" for batch in failed)
+            )
+
+    def _wait_for_batch(self, batch, poll_interval: float, max_poll_interval: float):
+        """
+        Poll the batch with exponential backoff until it has finished.
+
+        Parameters
+        ----------
+        batch:
+            The submitted batch.
+        poll_interval:
+            The initial number of seconds to wait between checks on the batch status.
+        max_poll_interval:
+            The maximum number of seconds to wait between checks on the batch status.
+
+        Returns
+        -------
+        Batch:
+            The finished batch.
+        """
+        delay = poll_interval
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(delay)
+            delay = min(delay * 2, max_poll_interval)
+
+            batch = self.client.batches.retrieve(batch.id)
+            logging.debug(f"Batch {batch.id} status: {batch.status}.")
+
+        return batch
+
+    def _write_batch_results(self, batch, pending: dict):
+        """
+        Write the flashcards from a completed batch. A result which can't be used is logged
+        and skipped, so it doesn't stop the rest of the batch from being written.
+
+        Parameters
+        ----------
+        batch:
+            The completed batch.
+        pending:
+            A dict mapping each custom_id in the batch to a (content, input_mtime_ns,
+            output_file_path) tuple.
+        """
+        missing = set(pending)
+
+        # Requests which failed outright are only reported in the error file
+        if batch.error_file_id:
+            for line in self.client.files.content(batch.error_file_id).iter_lines():
+                if not line:
+                    continue
+
+                try:
+                    result = orjson.loads(line)
+                    custom_id = result["custom_id"]
+                except (ValueError, KeyError, TypeError):
+                    logging.error(f"Could not parse batch error: {line}")
+                    continue
+
+                missing.discard(custom_id)
+                error = result.get("error") or result.get("response")
+                logging.error(f"Failed to process {custom_id}: {error}")
+
+        # The output file is missing if every request failed
+        if batch.output_file_id:
+            for line in self.client.files.content(batch.output_file_id).iter_lines():
+                if not line:
+                    continue
+
+                custom_id = None
+
+                try:
+                    result = orjson.loads(line)
+                    custom_id = result["custom_id"]
+                    missing.discard(custom_id)
+
+                    response = result.get("response")
+                    if result.get("error") or not response or response["status_code"] != 200:
+                        raise ValueError(result.get("error") or response)
+
+                    body = response["body"]
+                    message = body["choices"][0]["message"]
+                    total_tokens = body["usage"]["total_tokens"]
+
+                    # The content is empty if the model refused the request
+                    if message["content"] is None:
+                        raise ValueError(f"No content returned: {message.get('refusal')}")
+
+                    flashcards = orjson.loads(message["content"])["cards"]
+                    self.validate_flashcards(flashcards)
+
+                    logging.debug(f"Generated flashcards: {flashcards}")
+                    logging.info(
+                        f"Generated {len(flashcards)} flashcards. Used {total_tokens} tokens."
                     )
 
-                    # Create the output directory if it doesn't exist
-                    os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+                    content, input_mtime_ns, output_file_path = pending[custom_id]
+
+                    self._set_cached(content, flashcards)
+                    self._write_flashcards(output_file_path, flashcards)
+                    self._write_sidecar(output_file_path, content, input_mtime_ns)
+                except (ValueError, KeyError, TypeError, IndexError, OSError) as e:
+                    logging.error(f"Failed to process {custom_id or line}: {e}")
+
+        for custom_id in sorted(missing):
+            logging.error(f"Failed to process {custom_id}: no result returned by the batch.")
+
+    def _write_flashcards(self, output_file_path: str, flashcards: list):
+        """
+        Format the flashcards and write them to the output file. The flashcards are written
+        to a temporary file which then replaces the output file, so an interrupted write
+        never leaves a partial file behind to be skipped on the next run.
+
+        Parameters
+        ----------
+        output_file_path:
+            The path to the output file.
+        flashcards:
+            The flashcards to write.
+        """
+        # Format before opening the file so an invalid format doesn't leave it truncated
+        output = self._format_chunks(flashcards)
+        tmp_file_path = output_file_path + ".tmp"
+
+        with open(tmp_file_path, "w", encoding="utf-8") as outfile:
+            logging.info(f"Writing flashcards to {output_file_path}.")
+            logging.debug(f"Writing {flashcards} to {output_file_path}.")
+
+            outfile.writelines(output)
+
+        os.replace(tmp_file_path, output_file_path)
+
+    async def _write_flashcards_async(self, output_file_path: str, flashcards: list):
+        """
+        Format the flashcards and write them to the output file without blocking the event
+        loop. Like `_write_flashcards`, the output file is replaced atomically.
+
+        Parameters
+        ----------
+        output_file_path:
+            The path to the output file.
+        flashcards:
+            The flashcards to write.
+        """
+        output = self._format_chunks(flashcards)
+        tmp_file_path = output_file_path + ".tmp"
+
+        async with aiofiles.open(tmp_file_path, "w", encoding="utf-8") as outfile:
+            logging.info(f"Writing flashcards to {output_file_path}.")
+            logging.debug(f"Writing {flashcards} to {output_file_path}.")
+
+            await outfile.writelines(output)
+
+        os.replace(tmp_file_path, output_file_path)
+
+    def _collect_files(self, overwrite_files: bool = False) -> list:
+        """
+        Recursively find the .md files in input_dir which need flashcards created for them,
+        creating the matching directories in output_dir.
+
+        Parameters
+        ----------
+        overwrite_files:
+            Whether to include files which already exist in the output directory. Unless
+            `use_cache` is False, files which haven't changed since their flashcards were
+            generated are still skipped, since they would only be regenerated from the cache.
+
+        Returns
+        -------
+        list:
+            A list of (input_file_path, relative_path, output_file_path) tuples, where
+            relative_path is the input's path relative to input_dir.
+        """
+        tasks = []
+
+        # Sort so runs over the same tree pack files into requests the same way
+        for input_file_path, relative_path in sorted(self._iter_md_files(self.input_dir)):
+            output_file_path = os.path.join(self.output_dir, relative_path)
+
+            # Create the output directory if it doesn't exist
+            os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+
+            if os.path.exists(output_file_path) and not overwrite_files:
+                logging.info(f"Skipping {output_file_path}. File already exists.")
+            elif self.use_cache and self._is_unchanged(input_file_path, output_file_path):
+                logging.info(f"Skipping {input_file_path}. Unchanged since last run.")
+            else:
+                tasks.append((input_file_path, relative_path, output_file_path))
+
+        return tasks
+
+    @cached_property
+    def _request_fingerprint(self) -> str:
+        """
+        A hash of everything other than the content which goes into a request, so that
+        changing the models or prompt means files are processed again.
+        """
+        fingerprint = {
+            "request": self._build_request("", model=self.model),
+            "fast_model": self.fast_model,
+            "fast_model_max_chars": self.fast_model_max_chars,
+        }
+
+        return hashlib.sha1(orjson.dumps(fingerprint, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+    def _write_sidecar(self, output_file_path: str, content: str, input_mtime_ns: int):
+        """
+        Record which input the flashcards in the output file were generated from, in a
+        `.sha1` file next to it.
+
+        Parameters
+        ----------
+        output_file_path:
+            The path to the output file.
+        content:
+            The content of the input file.
+        input_mtime_ns:
+            The modification time of the input file when its content was read.
+        """
+        content_hash = hashlib.sha1(content.encode("utf-8")).hexdigest()
+        sidecar_path = output_file_path + ".sha1"
+
+        # Replaced atomically like the output file. The sidecar is always written after the
+        # output, so if a run is interrupted in between the file is just processed again.
+        with open(sidecar_path + ".tmp", "w", encoding="utf-8") as sidecar:
+            sidecar.write(f"{content_hash}\n{input_mtime_ns}\n{self._request_fingerprint}\n")
+
+        os.replace(sidecar_path + ".tmp", sidecar_path)
+
+    def _is_unchanged(self, input_file_path: str, output_file_path: str) -> bool:
+        """
+        Whether the flashcards in the output file were generated from the input file as it
+        is now. Only the modification times are compared unless they differ, in which case
+        the input is read and its hash compared instead.
+
+        Parameters
+        ----------
+        input_file_path:
+            The path to the input .md file.
+        output_file_path:
+            The path to the output file.
+
+        Returns
+        -------
+        bool:
+            True if the input file doesn't need processing again.
+        """
+        sidecar_path = output_file_path + ".sha1"
+
+        if not os.path.exists(output_file_path) or not os.path.exists(sidecar_path):
+            return False
+
+        with open(sidecar_path, "r", encoding="utf-8") as sidecar:
+            saved = sidecar.read().split("\n")
+
+        if len(saved) < 3 or saved[2] != self._request_fingerprint:
+            return False
+
+        saved_hash, saved_mtime_ns = saved[0], saved[1]
+        input_mtime_ns = os.stat(input_file_path).st_mtime_ns
+
+        if str(input_mtime_ns) == saved_mtime_ns:
+            return True
+
+        # The file has been touched, but may not have actually changed. If it can't be read,
+        # it's left for processing to report rather than stopping files being collected.
+        try:
+            with open(input_file_path, "r", encoding="utf-8") as infile:
+                content = infile.read()
+        except (OSError, UnicodeDecodeError):
+            return False
+
+        if hashlib.sha1(content.encode("utf-8")).hexdigest() != saved_hash:
+            return False
+
+        # Save the new modification time so the file isn't read again next run
+        self._write_sidecar(output_file_path, content, input_mtime_ns)
 
-                    if os.path.exists(output_file_path) and not overwrite_files:
-                        logging.info(f"Skipping {output_file_path}. File already exists.")
-                    else:
-                        self.process_file(input_file_path, output_file_path)
+        return True
+
+    def _iter_md_files(self, root: str):
+        """
+        Recursively find the .md files under root, skipping the output directory.
+        Directories are scanned in parallel since the work is dominated by filesystem latency.
+
+        Parameters
+        ----------
+        root:
+            The directory to search.
+
+        Yields
+        ------
+        tuple:
+            The absolute path of each .md file found and its path relative to root, in no
+            particular order.
+        """
+
+        def scan(directory: str, relative_prefix: str) -> tuple:
+            subdirs = []
+            md_files = []
+
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            # Prune the output directory here so it is never scanned
+                            if (entry.path + os.sep).startswith(self._output_prefix):
+                                logging.debug(f"Skipping {entry.path}. Output directory.")
+                            else:
+                                subdirs.append((entry.path, relative_prefix + entry.name + os.sep))
+                        elif entry.name.endswith(".md") and entry.is_file():
+                            md_files.append((entry.path, relative_prefix + entry.name))
+            except OSError as e:
+                logging.warning(f"Skipping {directory}. Could not be read: {e}")
+
+            return subdirs, md_files
+
+        max_workers = min(32, (os.cpu_count() or 1) * 4)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Scan from an absolute path so entry paths can be compared to the output prefix
+            # without resolving each one. Relative paths are built up alongside, so they
+            # don't need to be worked out from the absolute paths afterwards.
+            pending = {executor.submit(scan, os.path.abspath(root), "")}
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    subdirs, md_files = future.result()
+                    pending.update(executor.submit(scan, *subdir) for subdir in subdirs)
+
+                    yield from md_files
+
+    async def _gather(self, tasks: list, max_chars: int = 8000):
+        """
+        Process the given files concurrently. Files are packed into requests of at most
+        `max_chars` characters, with at most `max_concurrency` requests in flight at once.
+
+        Parameters
+        ----------
+        tasks:
+            A list of (input_file_path, relative_path, output_file_path) tuples to process,
+            as returned by `_collect_files`.
+        max_chars:
+            The maximum number of content characters to pack into a single request.
+        """
+        # Requests are limited by _complete, so this only limits the number of open files
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        # Identify each file in the packed prompt by its path relative to input_dir
+        output_file_paths = {
+            relative_path: output_file_path for _, relative_path, output_file_path in tasks
+        }
+
+        input_mtimes_ns = {}
+
+        async def read(input_file_path: str, item_id: str) -> Optional[tuple]:
+            # A file which can't be read is skipped rather than stopping the others
+            try:
+                async with semaphore:
+                    input_mtimes_ns[item_id] = os.stat(input_file_path).st_mtime_ns
+                    async with aiofiles.open(input_file_path, "r", encoding="utf-8") as infile:
+                        logging.debug(f"Reading content from {input_file_path}.")
+                        content = await infile.read()
+            except (OSError, UnicodeDecodeError) as e:
+                logging.error(f"Failed to process {item_id}: {e}")
+                return None
+
+            return item_id, content
+
+        items = await asyncio.gather(
+            *(read(input_file_path, relative_path) for input_file_path, relative_path, _ in tasks)
+        )
+        items = [item for item in items if item is not None]
+
+        async def run(pack: list):
+            flashcards = await self._create_flashcards_pack(pack)
+
+            for item_id, content in pack:
+                if item_id not in flashcards:
+                    logging.error(f"Failed to process {item_id}: no flashcards returned.")
+                    continue
+
+                output_file_path = output_file_paths[item_id]
+                async with semaphore:
+                    await self._write_flashcards_async(output_file_path, flashcards[item_id])
+                    self._write_sidecar(output_file_path, content, input_mtimes_ns[item_id])
+
+        # Pack each routed model's files separately so that a packed request goes to the
+        # same model that each of its items is cached against
+        items_by_model = defaultdict(list)
+        for item_id, content in items:
+            items_by_model[self._route_model(content)].append((item_id, content))
+
+        packs = [
+            pack
+            for model_items in items_by_model.values()
+            for pack in self._pack_items(model_items, max_chars)
+        ]
+        results = await asyncio.gather(*(run(pack) for pack in packs), return_exceptions=True)
+
+        # A failure in one pack shouldn't discard the work done on the others
+        for pack, result in zip(packs, results):
+            if isinstance(result, Exception):
+                for item_id, _ in pack:
+                    logging.error(f"Failed to process {item_id}: {result}")
 
     def format_flashcards(
         self,
@@ -228,24 +1443,49 @@ class FlashcardGenerator:
         str:
             The formatted flashcards.
         """
-        output = ""
+        return "".join(self._format_chunks(flashcards, format_type, include_tag))
 
+    def _format_chunks(
+        self,
+        flashcards: dict,
+        format_type: str = "obsidian_spaced_repetition",
+        include_tag: bool = True,
+    ):
+        """
+        Format the flashcards into chunks, one per card, which can be passed straight to
+        `writelines` without first joining them into a single string. Takes the same
+        parameters as `format_flashcards`.
+
+        Returns
+        -------
+        list:
+            The chunks of the formatted flashcards.
+
+        Raises
+        ------
+        ValueError:
+            If the format type is invalid.
+        """
         if format_type == "obsidian_spaced_repetition":
-            if include_tag:
-                output += "#flashcards\n\n"
+            return self._format_obsidian_spaced_repetition(flashcards, include_tag)
 
-            for card in flashcards:
-                if "front" in card and "back" in card:
-                    front = card["front"]
-                    back = card["back"]
-                    output += f"{front}\n?\n{back}\n\n"
-                else:
-                    logging.debug(f"Skipping invalid flashcard: {card}")
+        raise ValueError(f"Invalid format type: {format_type}")
 
-        else:
-            raise ValueError(f"Invalid format type: {format_type}")
+    @staticmethod
+    def _format_obsidian_spaced_repetition(flashcards: dict, include_tag: bool) -> list:
+        """
+        Format the flashcards for the Obsidian spaced repetition plugin.
+        """
+        chunks = ["#flashcards\n\n"] if include_tag else []
+        append = chunks.append
+
+        for card in flashcards:
+            try:
+                append(f"{card['front']}\n?\n{card['back']}\n\n")
+            except KeyError:
+                logging.debug(f"Skipping invalid flashcard: {card}")
 
-        return output
+        return chunks
 
     def validate_flashcards(self, flashcards: dict):
         """
@@ -261,20 +1501,15 @@ class FlashcardGenerator:
         ValueError:
             If the flashcards are not in the correct format.
         """
-
-        if not isinstance(flashcards, list):
-            raise ValueError("Flashcards must be a list.")
-
-        for card in flashcards:
-            if not isinstance(card, dict):
-                raise ValueError("Each flashcard must be a dict.")
-            if "front" not in card or "back" not in card:
-                raise ValueError("Each flashcard must have a 'front' and 'back' key.")
-            if not isinstance(card["front"], str) or not isinstance(card["back"], str):
-                raise ValueError("The 'front' and 'back' keys must be strings.")
+        try:
+            _CARDS_ADAPTER.validate_python(flashcards)
+        except ValidationError as e:
+            raise ValueError(f"Invalid flashcards: {e}") from e
 
 
 def main():
+    import fire
+
     # Load environment variables from .env file
     load_dotenv()
 
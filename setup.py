@@ -8,7 +8,12 @@ setup(
     install_requires=[
         "openai",
         "python-dotenv",
-        "cryptography"
+        "aiofiles",
+        "orjson",
+        "tenacity",
+        "tiktoken",
+        "pydantic>=2",
+        "httpx[http2]"
     ],
     entry_points={
         'console_scripts': [
@@ -20,5 +25,5 @@ setup(
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.8',
 )
@@ -0,0 +1,607 @@
+import asyncio
+import os
+import re
+
+import httpx
+import orjson
+import pytest
+
+from generate_flashcards import generate_flashcards
+from generate_flashcards.generate_flashcards import FlashcardGenerator, _TokenBucket
+
+
+class FakeClock:
+    """
+    A stand-in for time.monotonic and asyncio.sleep, where sleeping advances the clock.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeAPI:
+    """
+    Answers chat completion requests through an `httpx.MockTransport`, recording each
+    request body and the most requests it has handled at once. The reply for each request
+    is built by `respond`, which returns the message content, and defaults to one card per
+    file naming the model that answered.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.respond = self.cards
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @staticmethod
+    def cards(body: dict) -> str:
+        if body["response_format"]["json_schema"]["name"] == "packed_cards":
+            ids = re.findall(r"^### id=(.*)$", body["messages"][-1]["content"], re.MULTILINE)
+            results = [
+                {"id": item_id, "cards": [{"front": item_id, "back": body["model"]}]}
+                for item_id in ids
+            ]
+            return orjson.dumps({"results": results}).decode("utf-8")
+
+        return orjson.dumps({"cards": [{"front": "Q", "back": body["model"]}]}).decode("utf-8")
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        body = orjson.loads(request.content)
+        self.requests.append(body)
+
+        # Give other requests the chance to be sent while this one is being answered
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+
+        chunks = [
+            {"choices": [{"index": 0, "delta": {"content": self.respond(body)}}]},
+            {
+                "choices": [],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            },
+        ]
+        events = b"".join(
+            b"data: "
+            + orjson.dumps(
+                {
+                    "id": "chatcmpl",
+                    "object": "chat.completion.chunk",
+                    "created": 0,
+                    "model": body["model"],
+                    **chunk,
+                }
+            )
+            + b"\n\n"
+            for chunk in chunks
+        )
+
+        return httpx.Response(
+            200,
+            headers={"content-type": "text/event-stream"},
+            content=events + b"data: [DONE]\n\n",
+        )
+
+    def client(self):
+        from openai import AsyncOpenAI
+
+        return AsyncOpenAI(
+            api_key="test",
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(self.handle)),
+            max_retries=0,
+        )
+
+
+class FakeBatchAPI:
+    """
+    Runs Batch API jobs through an `httpx.MockTransport`. Each batch completes as soon as
+    it's created, with the line for each request built by `result`, which returns None to
+    leave the request out. Lines without a 200 response go to the batch's error file.
+    """
+
+    def __init__(self):
+        self.batches = []
+        self.files = {}
+        self.result = self.completed
+
+    @staticmethod
+    def completed(request: dict, content: str = None) -> dict:
+        if content is None:
+            content = FakeAPI.cards(request["body"])
+
+        message = {"role": "assistant", "content": content}
+
+        return {
+            "custom_id": request["custom_id"],
+            "response": {
+                "status_code": 200,
+                "body": {"choices": [{"message": message}], "usage": {"total_tokens": 2}},
+            },
+            "error": None,
+        }
+
+    def add_file(self, lines: list) -> str:
+        file_id = f"file-{len(self.files)}"
+        self.files[file_id] = lines
+
+        return file_id
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+
+        if path == "/v1/files":
+            # The JSONL lines are the only ones in the multipart body which start with "{"
+            lines = [
+                orjson.loads(line) for line in request.content.split(b"\n") if line.startswith(b"{")
+            ]
+            return httpx.Response(200, json={"id": self.add_file(lines), "object": "file"})
+
+        if path == "/v1/batches":
+            requests = self.files[orjson.loads(request.content)["input_file_id"]]
+            self.batches.append(requests)
+
+            lines = [line for line in map(self.result, requests) if line is not None]
+            output = [
+                line for line in lines if (line.get("response") or {}).get("status_code") == 200
+            ]
+            errors = [line for line in lines if line not in output]
+
+            return httpx.Response(
+                200,
+                json={
+                    "id": f"batch-{len(self.batches)}",
+                    "object": "batch",
+                    "status": "completed",
+                    "output_file_id": self.add_file(output) if output else None,
+                    "error_file_id": self.add_file(errors) if errors else None,
+                },
+            )
+
+        file_id = path.split("/")[3]
+        return httpx.Response(
+            200, content=b"".join(orjson.dumps(line) + b"\n" for line in self.files[file_id])
+        )
+
+    def client(self):
+        from openai import OpenAI
+
+        return OpenAI(
+            api_key="test",
+            http_client=httpx.Client(transport=httpx.MockTransport(self.handle)),
+            max_retries=0,
+        )
+
+
+def patch_client(monkeypatch, name: str, create_client):
+    """
+    Replace one of FlashcardGenerator's clients. Like the real client it's cached on the
+    instance, and a new one is created if a run has closed and discarded it.
+    """
+
+    def client(self):
+        if name not in self.__dict__:
+            self.__dict__[name] = create_client()
+
+        return self.__dict__[name]
+
+    monkeypatch.setattr(FlashcardGenerator, name, property(client))
+
+
+@pytest.fixture
+def api(monkeypatch) -> FakeAPI:
+    api = FakeAPI()
+    patch_client(monkeypatch, "async_client", api.client)
+
+    return api
+
+
+@pytest.fixture
+def batch_api(monkeypatch) -> FakeBatchAPI:
+    batch_api = FakeBatchAPI()
+    patch_client(monkeypatch, "client", batch_api.client)
+
+    return batch_api
+
+
+@pytest.fixture
+def notes(tmp_path):
+    """
+    Write the given notes, a dict mapping paths to content, under an input directory.
+    """
+    input_dir = tmp_path / "notes"
+
+    def write(files: dict):
+        for path, content in files.items():
+            file_path = input_dir / path
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+
+            if isinstance(content, bytes):
+                file_path.write_bytes(content)
+            else:
+                file_path.write_text(content, encoding="utf-8")
+
+        return input_dir
+
+    return write
+
+
+@pytest.fixture
+def word_tokens(monkeypatch):
+    # Count words rather than tokens, so chunk sizes are easy to reason about
+    monkeypatch.setattr(
+        generate_flashcards, "_token_counter", lambda model: lambda text: len(text.split())
+    )
+
+
+@pytest.fixture
+def generator(tmp_path, word_tokens) -> FlashcardGenerator:
+    return FlashcardGenerator(api_key="test", input_dir=str(tmp_path))
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(generate_flashcards.time, "monotonic", clock)
+    monkeypatch.setattr(generate_flashcards.asyncio, "sleep", clock.sleep)
+
+    return clock
+
+
+def test_chunk_markdown_leaves_short_text_untouched(generator):
+    text = "# Title\n\none two three"
+
+    assert generator._chunk_markdown(text, max_tokens=5) == [text]
+
+
+def test_chunk_markdown_splits_at_headings(generator):
+    text = "# A\nx y\n# B\nz w"
+
+    assert generator._chunk_markdown(text, max_tokens=5) == ["# A\nx y", "# B\nz w"]
+
+
+def test_chunk_markdown_merges_small_sections(generator):
+    text = "# A\n# B\n# C"
+
+    assert generator._chunk_markdown(text, max_tokens=5) == ["# A\n\n# B", "# C"]
+
+
+def test_chunk_markdown_splits_long_sections_at_paragraphs(generator):
+    text = "# A\none two\n\nthree four\n\nfive six"
+
+    assert generator._chunk_markdown(text, max_tokens=4) == [
+        "# A\none two",
+        "three four\n\nfive six",
+    ]
+
+
+def test_chunk_markdown_keeps_long_paragraphs_whole(generator):
+    text = "one two three four five six"
+
+    assert generator._chunk_markdown(text, max_tokens=3) == [text]
+
+
+def test_pack_items_fills_packs_up_to_the_limit():
+    items = [("a", "xxxx"), ("b", "xxxx"), ("c", "x")]
+
+    assert FlashcardGenerator._pack_items(items, max_chars=8) == [
+        [("a", "xxxx"), ("b", "xxxx")],
+        [("c", "x")],
+    ]
+
+
+def test_pack_items_puts_oversized_items_alone():
+    items = [("a", "x"), ("big", "x" * 20), ("b", "x")]
+
+    assert FlashcardGenerator._pack_items(items, max_chars=8) == [
+        [("a", "x")],
+        [("big", "x" * 20)],
+        [("b", "x")],
+    ]
+
+
+def test_pack_items_handles_no_items():
+    assert FlashcardGenerator._pack_items([], max_chars=8) == []
+
+
+def test_token_bucket_refills_over_time(clock):
+    bucket = _TokenBucket(60)
+    asyncio.run(bucket.acquire(60))
+
+    clock.now += 30
+    bucket._refill()
+    assert bucket.available == 30
+
+    # The bucket never holds more than its limit
+    clock.now += 1000
+    bucket._refill()
+    assert bucket.available == 60
+
+
+def test_token_bucket_waits_for_capacity(clock):
+    bucket = _TokenBucket(60)
+    asyncio.run(bucket.acquire(60))
+    asyncio.run(bucket.acquire(30))
+
+    assert clock.sleeps == [30]
+    assert bucket.available == 0
+
+
+def test_token_bucket_caps_oversized_requests(clock):
+    bucket = _TokenBucket(10)
+
+    # A full bucket lets an oversized request through straight away
+    asyncio.run(bucket.acquire(100))
+    assert clock.sleeps == []
+    assert bucket.available == 0
+
+    # Otherwise it only waits for the bucket to be full again
+    asyncio.run(bucket.acquire(100))
+    assert clock.sleeps == [60]
+    assert bucket.available == 0
+
+
+def test_process_files_skips_unreadable_files(api, notes, tmp_path):
+    input_dir = notes({"bad.md": b"\xff\xfe not utf-8", "good.md": "A short note."})
+    generator = FlashcardGenerator(
+        api_key="test", input_dir=str(input_dir), output_dir=str(tmp_path / "out")
+    )
+
+    generator.process_files()
+
+    output_dir = tmp_path / "out" / "flashcards"
+    assert (output_dir / "good.md").exists()
+    assert not (output_dir / "bad.md").exists()
+    assert len(api.requests) == 1
+
+
+def test_process_files_skips_files_which_became_unreadable(api, notes, tmp_path):
+    input_dir = notes({"bad.md": "A short note.", "good.md": "Another short note."})
+    generator = FlashcardGenerator(
+        api_key="test", input_dir=str(input_dir), output_dir=str(tmp_path / "out")
+    )
+    generator.process_files()
+
+    # The touched file has to be read to tell whether it has changed
+    notes({"bad.md": b"\xff\xfe not utf-8"})
+    generator.process_files(overwrite_files=True)
+
+    output_dir = tmp_path / "out" / "flashcards"
+    assert (output_dir / "bad.md").exists()
+    assert (output_dir / "good.md").exists()
+
+
+def test_process_files_batch_skips_unreadable_files(batch_api, notes, tmp_path):
+    input_dir = notes({"bad.md": b"\xff\xfe not utf-8", "good.md": "A short note."})
+    generator = FlashcardGenerator(
+        api_key="test", input_dir=str(input_dir), output_dir=str(tmp_path / "out")
+    )
+
+    generator.process_files(batch=True)
+
+    output_dir = tmp_path / "out" / "flashcards"
+    assert (output_dir / "good.md").exists()
+    assert not (output_dir / "bad.md").exists()
+    assert [[request["custom_id"] for request in batch] for batch in batch_api.batches] == [
+        ["good.md"]
+    ]
+
+
+def test_max_concurrency_limits_requests_for_chunks(api, notes, tmp_path, word_tokens):
+    input_dir = notes({"long.md": "\n".join(f"# Heading {i}\nsome words" for i in range(10))})
+    generator = FlashcardGenerator(
+        api_key="test",
+        input_dir=str(input_dir),
+        output_dir=str(tmp_path / "out"),
+        max_concurrency=2,
+        max_chunk_tokens=5,
+    )
+
+    generator.process_files()
+
+    assert len(api.requests) == 10
+    assert api.max_in_flight == 2
+
+
+def test_fast_model_falls_back_when_its_reply_is_malformed(api, notes, tmp_path):
+    input_dir = notes({"note.md": "A short note."})
+    generator = FlashcardGenerator(
+        api_key="test", input_dir=str(input_dir), output_dir=str(tmp_path / "out")
+    )
+    api.respond = lambda body: '{"cards": [' if body["model"] == "gpt-4o-mini" else api.cards(body)
+
+    generator.process_files()
+
+    assert [body["model"] for body in api.requests] == ["gpt-4o-mini", "gpt-4o"]
+    assert "gpt-4o" in (tmp_path / "out" / "flashcards" / "note.md").read_text()
+
+
+def test_packed_fast_model_falls_back_for_invalid_items(api, notes, tmp_path):
+    input_dir = notes({"a.md": "A short note.", "b.md": "Another short note."})
+    generator = FlashcardGenerator(
+        api_key="test", input_dir=str(input_dir), output_dir=str(tmp_path / "out")
+    )
+
+    def respond(body: dict) -> str:
+        reply = orjson.loads(api.cards(body))
+        if body["model"] == "gpt-4o-mini":
+            reply["results"][1]["cards"] = [{"front": "No back"}]
+
+        return orjson.dumps(reply).decode("utf-8")
+
+    api.respond = respond
+
+    generator.process_files()
+
+    # Only the item the fast model got wrong is sent to the main model
+    assert [body["model"] for body in api.requests] == ["gpt-4o-mini", "gpt-4o"]
+    assert "### id=a.md" not in api.requests[1]["messages"][-1]["content"]
+
+    output_dir = tmp_path / "out" / "flashcards"
+    assert "gpt-4o-mini" in (output_dir / "a.md").read_text()
+    assert "gpt-4o" in (output_dir / "b.md").read_text()
+    assert "gpt-4o-mini" not in (output_dir / "b.md").read_text()
+
+
+def test_unchanged_files_are_skipped_until_their_content_changes(api, notes, tmp_path):
+    input_dir = notes({"note.md": "A short note."})
+    generator = FlashcardGenerator(
+        api_key="test", input_dir=str(input_dir), output_dir=str(tmp_path / "out")
+    )
+    generator.process_files()
+    sidecar_path = tmp_path / "out" / "flashcards" / "note.md.sha1"
+
+    generator.process_files(overwrite_files=True)
+    assert len(api.requests) == 1
+
+    # Touching the file without changing it only refreshes the sidecar
+    os.utime(input_dir / "note.md", ns=(1, 1))
+    generator.process_files(overwrite_files=True)
+    assert len(api.requests) == 1
+    assert sidecar_path.read_text().split("\n")[1] == "1"
+
+    notes({"note.md": "A different short note."})
+    generator.process_files(overwrite_files=True)
+    assert len(api.requests) == 2
+
+
+def test_changing_the_model_invalidates_the_cache_and_sidecars(api, notes, tmp_path):
+    content = "A long note. " * 50
+    input_dir = notes({"note.md": content})
+    output_dir = tmp_path / "out"
+    generator = FlashcardGenerator(
+        api_key="test", input_dir=str(input_dir), output_dir=str(output_dir)
+    )
+    generator.process_files()
+
+    changed = FlashcardGenerator(
+        api_key="test", input_dir=str(input_dir), output_dir=str(output_dir), model="gpt-4-turbo"
+    )
+    assert changed._cache_key(content) != generator._cache_key(content)
+
+    changed.process_files(overwrite_files=True)
+
+    assert [body["model"] for body in api.requests] == ["gpt-4o", "gpt-4-turbo"]
+
+
+def test_request_fingerprint_covers_routing(tmp_path):
+    def fingerprint(**kwargs) -> str:
+        generator = FlashcardGenerator(api_key="test", input_dir=str(tmp_path), **kwargs)
+
+        return generator._request_fingerprint
+
+    assert fingerprint() == fingerprint()
+    assert fingerprint() != fingerprint(fast_model="gpt-3.5-turbo")
+    assert fingerprint() != fingerprint(fast_model_max_chars=1000)
+
+
+def test_write_flashcards_leaves_no_partial_file(generator, tmp_path, monkeypatch):
+    output_file_path = tmp_path / "note.md"
+    generator._write_flashcards(str(output_file_path), [{"front": "Q", "back": "A"}])
+    original = output_file_path.read_text()
+
+    assert not (tmp_path / "note.md.tmp").exists()
+
+    # An interrupted write leaves the previous flashcards in place
+    def replace(src, dst):
+        raise OSError("interrupted")
+
+    monkeypatch.setattr(generate_flashcards.os, "replace", replace)
+
+    with pytest.raises(OSError):
+        generator._write_flashcards(str(output_file_path), [{"front": "New", "back": "A"}])
+    with pytest.raises(OSError):
+        asyncio.run(
+            generator._write_flashcards_async(
+                str(output_file_path), [{"front": "New", "back": "A"}]
+            )
+        )
+
+    assert output_file_path.read_text() == original
+
+
+def test_batch_results_which_cant_be_used_are_skipped(batch_api, notes, tmp_path, caplog):
+    input_dir = notes(
+        {
+            "ok.md": "A short note.",
+            "refused.md": "A refused note.",
+            "failed.md": "A failed note.",
+            "missing.md": "A missing note.",
+            "malformed.md": "A malformed note.",
+        }
+    )
+    generator = FlashcardGenerator(
+        api_key="test", input_dir=str(input_dir), output_dir=str(tmp_path / "out")
+    )
+
+    def result(request: dict) -> dict:
+        custom_id = request["custom_id"]
+
+        if custom_id == "refused.md":
+            line = batch_api.completed(request)
+            line["response"]["body"]["choices"][0]["message"] = {
+                "role": "assistant",
+                "content": None,
+                "refusal": "I can't help with that.",
+            }
+            return line
+        if custom_id == "failed.md":
+            return {"custom_id": custom_id, "response": {"status_code": 500}, "error": None}
+        if custom_id == "missing.md":
+            return None
+        if custom_id == "malformed.md":
+            return batch_api.completed(request, content='{"cards": [')
+
+        return batch_api.completed(request)
+
+    batch_api.result = result
+
+    generator.process_files(batch=True)
+
+    output_dir = tmp_path / "out" / "flashcards"
+    assert sorted(path.name for path in output_dir.glob("*.md")) == ["ok.md"]
+
+    for custom_id in ["refused.md", "failed.md", "missing.md", "malformed.md"]:
+        assert f"Failed to process {custom_id}" in caplog.text
+
+
+def test_files_are_packed_per_routed_model(api, notes, tmp_path):
+    input_dir = notes(
+        {
+            "short1.md": "A short note.",
+            "short2.md": "Another short note.",
+            "long1.md": "A long note. " * 50,
+            "long2.md": "Another long note. " * 50,
+        }
+    )
+    output_dir = tmp_path / "out"
+    generator = FlashcardGenerator(
+        api_key="test", input_dir=str(input_dir), output_dir=str(output_dir)
+    )
+
+    generator.process_files()
+
+    packs = {
+        body["model"]: re.findall(r"^### id=(.*)$", body["messages"][-1]["content"], re.MULTILINE)
+        for body in api.requests
+    }
+    assert packs == {
+        "gpt-4o": ["long1.md", "long2.md"],
+        "gpt-4o-mini": ["short1.md", "short2.md"],
+    }
+
+    # Each file was cached against the model which answered it
+    for path in (output_dir / "flashcards").glob("*.md"):
+        path.unlink()
+
+    generator.process_files()
+
+    assert len(api.requests) == 2